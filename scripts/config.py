@@ -24,10 +24,30 @@ class Config():
         # whether to download the scenes or not
         self.download_scenes = False
         self.save_footprints = True
+        # footprints are saved in GeoParquet format. Set to True to save them in GeoJSON format instead
+        self.legacy_geojson = False
         self.update_json = False
+        # maximum number of scenes downloaded in parallel
+        # the Copernicus hub allows at most 2 concurrent downloads per user
+        self.max_concurrent_downloads_sentinel = 2
+        self.max_concurrent_downloads_landsat = 4
+        # maximum number of Sentinel products retrieved from the Long Term Archive (LTA) at the same time
+        # (across all the fire events processed in parallel)
+        self.max_concurrent_lta_requests = 10
+        # number of connections kept alive per API host
+        self.connection_pool_size = 8
+        # maximum number of fire events processed in parallel when a file of event IDs is given
+        self.max_parallel_events = 4
         # [directory]
         self.data_dir = os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'data')) # ("../data/") 
 
+        # [cache]
+        # whether to cache the search results of the Landsat and Sentinel APIs on disk
+        self.cache_api_responses = True
+        # time (in seconds) after which cached responses are revalidated with the server
+        self.cache_expire_after = 24 * 60 * 60
+        self.cache_file = os.path.join(self.data_dir, "api_cache.sqlite")
+
         if os.name == 'nt':  # Windows
             self.dir_sep = '\\'
         else:  # Linux, macOS, and other platforms
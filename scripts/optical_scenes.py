@@ -1,22 +1,96 @@
 import os
 import sys
 import json
+import orjson
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 import pyproj
 from landsatxplore.api import API
-from sentinelsat import SentinelAPI, geojson_to_wkt, LTATriggered
+from sentinelsat import SentinelAPI, SentinelAPIError, LTATriggered, LTAError
 from config import Config
-import glob, time
+import glob, time, random
 import geopandas as gpd
+import pyogrio
 from landsatxplore.earthexplorer import EarthExplorer
-import shapely
+from shapely.geometry import box
 import argparse
+import atexit
+import contextlib
+import functools
+import threading
+import requests
+import requests_cache
+from concurrent.futures import ThreadPoolExecutor
 
 config = Config()
 
+# creating a transformer parses the CRS definitions, so only do it once
+TRANSFORMER_3395_TO_4326 = pyproj.Transformer.from_crs("epsg:3395", "epsg:4326")
 
-def download_product(api, product_id, output_directory, num_retries=10, retry_wait=120):
+# limits the number of Sentinel products retrieved from the LTA at the same time by this process
+# (including those of fire events processed in parallel by main_batch)
+LTA_SEMAPHORE = threading.Semaphore(config.max_concurrent_lta_requests)
+# limits the number of Sentinel products downloaded at the same time by this process. The Copernicus
+# hub rejects users with more concurrent downloads ("concurrent flows") than it allows
+DOWNLOAD_SEMAPHORE = threading.Semaphore(config.max_concurrent_downloads_sentinel)
+
+
+def trigger_retrieval(api, product_id, num_retries, retry_wait, max_retry_wait, jitter):
+    """
+    Requests the retrieval of an offline Sentinel-2 product from the Long Term Archive (LTA).
+
+    The request is retried with an exponential backoff (plus random jitter) if the LTA does not
+    queue it, e.g. because the user quota is exceeded or too many requests are running.
+
+    Returns:
+        bool: True if the retrieval was queued (or the product is online), False otherwise.
+    """
+    for i in range(num_retries):
+        try:
+            if api.trigger_offline_retrieval(product_id):
+                print(f"Retrieval of product {product_id} from the LTA was triggered.")
+                return True
+            reason = "was not accepted"
+        except LTAError as e:
+            reason = f"was rejected ({e})"
+        if api.is_online(product_id):
+            return True
+        if i == num_retries - 1:
+            break
+        wait = min(retry_wait * 2**i, max_retry_wait) + random.uniform(0, jitter)
+        print(f"Retrieval of product {product_id} from the LTA {reason}. Retrying in {wait/60:.1f} minutes.")
+        time.sleep(wait)
+    print(f"Failed to trigger the retrieval of product {product_id} after {num_retries} attempts.")
+    return False
+
+
+def wait_until_online(api, product_id, timeout, retry_wait, max_retry_wait, jitter):
+    """
+    Waits up to timeout seconds for a Sentinel-2 product to be retrieved from the Long Term Archive (LTA).
+
+    The product is checked right away, then after retry_wait seconds. The time between checks
+    doubles after each check (up to max_retry_wait, plus random jitter), so a product that takes
+    hours to be retrieved is not checked every minute.
+
+    Returns:
+        bool: True if the product came online, False if it is still offline after the timeout.
+    """
+    deadline = time.monotonic() + timeout
+    i = 0
+    while True:
+        if api.is_online(product_id):
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        wait = min(retry_wait * 2**i, max_retry_wait) + random.uniform(0, jitter)
+        time.sleep(min(wait, remaining))
+        i += 1
+
+
+def download_product(api, product_id, output_directory, num_retries=10, retry_wait=120,
+                     max_retry_wait=1800, jitter=30, timeout=24*60*60):
     """
     Downloads a Sentinel-2 product using the sentinelsat package.
 
@@ -29,34 +103,259 @@ def download_product(api, product_id, output_directory, num_retries=10, retry_wa
             used for downloading the product.
         product_id (str): The ID of the product to download.
         output_directory (str): The directory path where the downloaded product will be saved.
-        num_retries (int, optional): The number of times to retry the download in case of failure.
-            Default is 10.
-        retry_wait (int, optional): The wait time in seconds between retries in case of failure.
+        num_retries (int, optional): The number of times to request the retrieval of an offline product
+            from the Long Term Archive (LTA) if the request is not accepted, and to try downloading the
+            product if the download fails. Default is 10.
+        retry_wait (int, optional): The first wait time in seconds, both between retrieval requests and
+            between checks of whether the product is online. The wait time doubles after each attempt.
             Default is 120 seconds.
+        max_retry_wait (int, optional): The maximum wait time in seconds.
+            Default is 1800 seconds (30 minutes).
+        jitter (int, optional): The maximum number of seconds randomly added to each wait time.
+            Default is 30 seconds.
+        timeout (int, optional): The maximum time in seconds to wait for an offline product to be
+            retrieved from the LTA. Default is 24 hours.
 
     Returns:
         None: The function doesn't return a value, but it prints messages to inform the user
             about the download progress and success/failure.
 
-    Raises:
-        LTATriggered: If the product is not available for direct download and needs to be triggered.
-
     Notes:
         - The function uses the 'download' method of the sentinelsat package to download the product.
-        - If the product is not available for direct download, the function waits and retries the download.
+        - If the product is offline, the function requests its retrieval from the LTA (retrying with an
+          exponential backoff if the request is not accepted), waits for the product to come online
+          and only then downloads it. Retrieving a product from the LTA can take up to 24 hours.
+        - No more than config.max_concurrent_lta_requests products are retrieved from the LTA and no more than
+          config.max_concurrent_downloads_sentinel products are downloaded at the same time, across all the
+          calls of this function. A download that fails (e.g. because the hub rejects it) is retried with the
+          same exponential backoff.
     """
+    if not api.is_online(product_id):
+        # hold one of the config.max_concurrent_lta_requests LTA slots until the product is online
+        with LTA_SEMAPHORE:
+            if not trigger_retrieval(api, product_id, num_retries, retry_wait, max_retry_wait, jitter):
+                return
+            print(f"Waiting up to {timeout/3600:.1f} hours for product {product_id} to come online.")
+            if not wait_until_online(api, product_id, timeout, retry_wait, max_retry_wait, jitter):
+                print(f"Failed to download product {product_id}: it did not come online within {timeout/3600:.1f} hours.")
+                return
+
     for i in range(num_retries):
         try:
-            # Try to download the product
-            api.download(product_id, directory_path = output_directory)
+            # the semaphore is held for the whole download (not just each chunk read)
+            with DOWNLOAD_SEMAPHORE:
+                api.download(product_id, directory_path = output_directory)
             print(f"Download of product {product_id} successful.")
             return
         except LTATriggered:
-            # The product is not available for direct download and needs to be triggered
-            print(f"Product {product_id} is not available for direct download. Retrying in {retry_wait/60} minutes.")
-            time.sleep(retry_wait)
-    print(f"Failed to download product {product_id} after {num_retries} retries.")
+            print(f"Failed to download product {product_id}: it went offline before it could be downloaded.")
+            return
+        except SentinelAPIError as e:
+            if i == num_retries - 1:
+                break
+            wait = min(retry_wait * 2**i, max_retry_wait) + random.uniform(0, jitter)
+            print(f"Download of product {product_id} failed ({e}). Retrying in {wait/60:.1f} minutes.")
+            time.sleep(wait)
+    print(f"Failed to download product {product_id} after {num_retries} attempts.")
+
+
+
+def _normalize_mixed_columns(gdf):
+    """
+    Returns a copy of gdf where the object columns holding values of different types are converted to strings.
+
+    The APIs parse each metadata value on its own, so a column can hold e.g. both 5.1 and 'N/A'.
+    GeoJSON stores each value as is, but (Geo)Parquet columns must have a single type.
+    Missing values are kept as they are.
+    """
+    gdf = gdf.copy()
+    for col in gdf.columns:
+        if col == gdf.geometry.name or gdf[col].dtype != object:
+            continue
+        values = gdf[col].dropna()
+        if values.map(type).nunique() > 1:
+            gdf[col] = gdf[col].where(gdf[col].isna(), gdf[col].astype(str))
+
+    return gdf
+
+
+def write_footprints(gdf, output_directory, satellite):
+    """
+    Writes the footprints of the products found for a fire event to disk.
+
+    Footprints are written in GeoParquet format by default, which is much faster to write and
+    read and much smaller on disk than GeoJSON. Set the legacy_geojson parameter in the config
+    file to True to write them in GeoJSON format instead.
+    Metadata columns with values of different types are written as strings in GeoParquet format.
+
+    Parameters:
+        gdf (geopandas.GeoDataFrame): The footprints and metadata of the products.
+        output_directory (str): The directory where the footprints will be saved.
+        satellite (str): The name of the satellite, used in the file name ("Sentinel" or "Landsat").
+
+    Returns:
+        str: The name of the written file.
+    """
+    if config.legacy_geojson:
+        fname = os.path.join(output_directory, f"{satellite}_footprints.geojson")
+        gdf.to_file(fname, driver='GeoJSON')
+    else:
+        fname = os.path.join(output_directory, f"{satellite}_footprints.parquet")
+        _normalize_mixed_columns(gdf).to_parquet(fname)
+
+    return fname
+
+
+# set (per thread) by skip_cache so _cacheable_response does not cache the responses of that thread
+_cache_state = threading.local()
+
+
+@contextlib.contextmanager
+def skip_cache(skip=True):
+    """
+    Context manager that stops the API responses received by the current thread from being cached.
+
+    Used for the searches whose end date is today or later: new scenes can still be acquired
+    in that date range, so their results should not be reused by later runs.
+    Unlike CachedSession.cache_disabled, it only affects the current thread.
+    """
+    previous = getattr(_cache_state, 'skip', False)
+    _cache_state.skip = skip
+    try:
+        yield
+    finally:
+        _cache_state.skip = previous
+
+
+def ends_today_or_later(end_date):
+    """
+    Returns True if end_date (a datetime object or a 'YYYY-MM-DD' string) is today or later.
+    """
+    return pd.Timestamp(end_date).date() >= datetime.now().date()
+
+
+def _cacheable_response(response):
+    """
+    Returns False for the responses that should not be cached.
+
+    The USGS M2M API (used by landsatxplore) reports errors such as RATE_LIMIT in the errorCode
+    field of the JSON body, even when the HTTP status is 200. Caching such a response would
+    serve the error again (e.g. to the rate limit retry of landsatxplore).
+    The responses received inside skip_cache are not cached either.
+    """
+    if getattr(_cache_state, 'skip', False):
+        return False
+
+    try:
+        body = response.json()
+    except ValueError:
+        return True
+
+    return not (isinstance(body, dict) and body.get('errorCode'))
+
+
+def cache_session(session, urls_expire_after, allowable_methods=('GET',)):
+    """
+    Returns a copy of an API's requests session that caches the API responses on disk.
+
+    Catalog queries are idempotent for a given footprint and date range, so re-running the
+    search for the same fire event does not need to query the catalog again. Cached responses
+    are reused until they expire (config.cache_expire_after). After that, they are revalidated
+    with the server using their ETag/Last-Modified headers (If-None-Match/If-Modified-Since).
+    If the server answers 304 Not Modified, the cached response is used.
+    Error responses (see _cacheable_response) are not cached.
+
+    Parameters:
+        session (requests.Session): The (authenticated) session of the API.
+        urls_expire_after (dict): URL patterns mapped to their expiration time. Use
+            requests_cache.DO_NOT_CACHE for the URLs that should not be cached (e.g. downloads).
+        allowable_methods (tuple, optional): The HTTP methods whose responses are cached. Default is ('GET',).
+
+    Returns:
+        requests_cache.CachedSession: The session to be used by the API.
+
+    https://requests-cache.readthedocs.io/en/stable/user_guide/expiration.html
+    """
+    cached_session = requests_cache.CachedSession(config.cache_file,
+                                                  backend='sqlite',
+                                                  cache_control=True,
+                                                  expire_after=config.cache_expire_after,
+                                                  allowable_methods=allowable_methods,
+                                                  urls_expire_after=urls_expire_after,
+                                                  filter_fn=_cacheable_response)
+    cached_session.auth = session.auth
+    cached_session.headers.update(session.headers)
+    cached_session.cookies.update(session.cookies)
+
+    return cached_session
+
 
+def mount_connection_pool(session, pool_size):
+    """
+    Mounts an HTTPAdapter on a requests session so up to pool_size connections to the same
+    host are kept alive and reused (instead of doing a new TLS handshake for each request).
+    """
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+
+@functools.lru_cache(maxsize=1)
+def _sentinel_api(username, password):
+    """
+    Returns a SentinelAPI instance for the given credentials.
+
+    The instance is created once and then reused by every call to get_sentinel, so its session
+    (connections and cached responses) is shared across fire events.
+    """
+    api = SentinelAPI(username, password, 'https://apihub.copernicus.eu/apihub')
+
+    if config.cache_api_responses:
+        # only cache the search and metadata queries. Downloads (.../$value) and
+        # online checks (.../Online/$value) should always go to the server.
+        # Note that the cached metadata includes an 'Online' flag that can be outdated,
+        # so use api.is_online to check whether a product is online
+        api.session = cache_session(api.session, {'*/$value': requests_cache.DO_NOT_CACHE,
+                                                  '*/search': config.cache_expire_after,
+                                                  '*/odata/v1/Products*': config.cache_expire_after,
+                                                  '*': requests_cache.DO_NOT_CACHE})
+    mount_connection_pool(api.session, config.connection_pool_size)
+
+    return api
+
+
+@functools.lru_cache(maxsize=1)
+def _landsat_api(username, password):
+    """
+    Returns a logged in landsatxplore API instance for the given credentials.
+
+    The instance is created (and logged in) once and then reused by every call to get_landsat.
+    It is logged out when the program exits.
+    """
+    api = API(username, password)
+    atexit.register(api.logout)
+
+    if config.cache_api_responses:
+        # the landsatxplore API sends its queries as GET requests with a JSON body (which is
+        # part of the cache key). Only cache the scene search, not the logout request
+        api.session = cache_session(api.session, {'*/scene-search': config.cache_expire_after,
+                                                  '*': requests_cache.DO_NOT_CACHE})
+    mount_connection_pool(api.session, config.connection_pool_size)
+
+    return api
+
+
+@functools.lru_cache(maxsize=1)
+def _earth_explorer(username, password):
+    """
+    Returns a logged in EarthExplorer instance (used for downloading Landsat scenes) for the
+    given credentials. The instance is created once and logged out when the program exits.
+    """
+    ee = EarthExplorer(username, password)
+    atexit.register(ee.logout)
+    mount_connection_pool(ee.session, config.connection_pool_size)
+
+    return ee
 
 
 def get_sentinel(event_id,
@@ -104,18 +403,19 @@ def get_sentinel(event_id,
     print(f"searching for Sentinel images for event ID: {event_id}")
     
     # initialize the API. Update your username and password in the config.py file
-    api = SentinelAPI(config.username_sentinel, config.password_sentinel,
-                    'https://apihub.copernicus.eu/apihub')
+    api = _sentinel_api(config.username_sentinel, config.password_sentinel)
     
 
     # Search for Sentinel-2 images before the start date
-    products = api.query(footprint,
-                        date=(start_date, end_date),
-                        area_relation='Intersects', # this is the defualt. Possible options {'Intersects', 'Contains', 'IsWithin'},
-                        cloudcoverpercentage = (0, config.max_cloud_cover),
-                        # processinglevel = 'Level-2A',
-                        producttype = producttype,
-                        platformname=platform)
+    # new images can still be acquired if the search ends today or later, so don't cache its results
+    with skip_cache(ends_today_or_later(end_date)):
+        products = api.query(footprint,
+                            date=(start_date, end_date),
+                            area_relation='Intersects', # this is the defualt. Possible options {'Intersects', 'Contains', 'IsWithin'},
+                            cloudcoverpercentage = (0, config.max_cloud_cover),
+                            # processinglevel = 'Level-2A',
+                            producttype = producttype,
+                            platformname=platform)
     
     
     # if any sentinel product is found
@@ -123,19 +423,14 @@ def get_sentinel(event_id,
         print(f"{len(products)} Sentinel products found for event {event_id}")
 
         # create directories for saving the images or the footprints
-        out_dir = os.path.join(config.data_dir,"Fire_events", event_id)
-        if not os.path.exists(out_dir):
-                os.mkdir(out_dir)
-        output_directory = os.path.join(out_dir, "Sentinel")
-        if not os.path.exists(output_directory):
-                os.mkdir(output_directory)
+        output_directory = os.path.join(config.data_dir, "Fire_events", event_id, "Sentinel")
+        os.makedirs(output_directory, exist_ok=True)
 
         # Save image footprints
         if config.save_footprints:
             print(f"Saving Sentinel product footprints for event{event_id} to {output_directory} ...")    
             gdf = api.to_geodataframe(products)
-            fname = f"{output_directory}/Sentinel_footprints.geojson"
-            gdf.to_file(fname, driver='GeoJSON') 
+            write_footprints(gdf, output_directory, "Sentinel")
 
 
         # download products
@@ -149,7 +444,14 @@ def get_sentinel(event_id,
             # a long time and a lot of space
             
             
-            api.download_all(products, directory_path = output_directory)
+            # download_product downloads the online products right away. The offline ones have to be
+            # retrieved from the Long Term Archive (LTA) first, which can take hours, so the products
+            # are handled in parallel. The number of LTA retrievals (config.max_concurrent_lta_requests)
+            # and downloads (config.max_concurrent_downloads_sentinel) is limited inside download_product,
+            # so the online products can be downloaded while offline ones are being retrieved
+            max_workers = config.max_concurrent_lta_requests + config.max_concurrent_downloads_sentinel
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(lambda uuid: download_product(api, uuid, output_directory), products))
             
             #################################
             # NOTE:
@@ -168,29 +470,28 @@ def get_sentinel(event_id,
         # when we used individual json files. I don't think it'll be needed
         # anymore, but I kept it anyway
         if config.update_json:
+            product_odata = {uuid: api.get_product_odata(uuid) for uuid in products}
+
             # Load the JSON file and append the scene information to it
-            with open(json_file_name, 'r') as file:
-                data = json.load(file)
-                data['features'][0]['sentinel_senes'] = []
-                
-                for product_id in products:
-                    product_info = api.get_product_odata(product_id)
-                    
-                    element = {
+            with open(json_file_name, 'rb') as file:
+                data = orjson.loads(file.read())
+                data['features'][0]['sentinel_senes'] = [
+                    {
                     'Scene_ID': product_info['title'],
-                    'acquisition_date': product_info['date'].strftime('%Y-%m-%d'),
-                    'ingestion_date': product_info['Ingestion Date'].strftime('%Y-%m-%d'),
+                    'acquisition_date': product_info['date'].date(),
+                    'ingestion_date': product_info['Ingestion Date'].date(),
                     'URL': product_info['url'],
                     'Quicklook_URL': product_info['quicklook_url'],
                     'footprint': product_info['footprint']
                     }
-
-                    data['features'][0]['sentinel_senes'].append(element)
+                    for product_info in (product_odata[product_id] for product_id in products)
+                ]
 
             # Write the modified JSON data back to the same file
             json_fname = os.path.join(output_directory, f"{event_id}.json")
-            with open(json_file_name, 'w') as file:
-                json.dump(data, file)
+            # orjson serializes the dates as "%Y-%m-%d" strings
+            with open(json_file_name, 'wb') as file:
+                file.write(orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY))
 
     else:
         print(f"No Sentinel-2 scenes found for the fire event {event_id}")
@@ -231,30 +532,28 @@ def get_landsat(event_id,
     print(f"searching for Landsat images for event ID: {event_id}")
 
     # initialize the API
-    api = API(config.username_landsat, config.password_landsat)
+    api = _landsat_api(config.username_landsat, config.password_landsat)
 
     # Search for Landsat 8 scenes
     # source: https://github.com/yannforget/landsatxplore/blob/master/landsatxplore/api.py
     # TODO: modify the dataset param in search based on the input platform param
-    scenes = api.search(
-        dataset='landsat_ot_c2_l1',
-        bbox=footprint,
-        start_date=start_date.strftime('%Y-%m-%d'),
-        end_date=end_date.strftime('%Y-%m-%d'),
-        max_cloud_cover=config.max_cloud_cover
-    )
+    # new scenes can still be acquired if the search ends today or later, so don't cache its results
+    with skip_cache(ends_today_or_later(end_date)):
+        scenes = api.search(
+            dataset='landsat_ot_c2_l1',
+            bbox=footprint,
+            start_date=start_date.strftime('%Y-%m-%d'),
+            end_date=end_date.strftime('%Y-%m-%d'),
+            max_cloud_cover=config.max_cloud_cover
+        )
 
     # Process the search results
     if scenes:
         print(f"{len(scenes)} Landsat products found for event {event_id}")
 
         # create output directories
-        out_dir = os.path.join(config.data_dir,"Fire_events", event_id)
-        if not os.path.exists(out_dir):
-                os.mkdir(out_dir)
-        output_directory = os.path.join(out_dir, "Landsat")
-        if not os.path.exists(output_directory):
-                os.mkdir(output_directory)
+        output_directory = os.path.join(config.data_dir, "Fire_events", event_id, "Landsat")
+        os.makedirs(output_directory, exist_ok=True)
 
         # Save image footprints
         if config.save_footprints:
@@ -264,20 +563,17 @@ def get_landsat(event_id,
             # dropping column spatial_bounds as it contains tuples and temporal_coverage as it contains lists
             # Fiona cannot write columns of type tuple or list to a file and
             # keeping this column would result in ValueError: Invalid field type <class 'tuple'>
-            df['temporal_coverage_start'] = df.apply (lambda row: row.temporal_coverage[0], axis=1)
-            df['temporal_coverage_end'] = df.apply (lambda row: row.temporal_coverage[1], axis=1)
-            df.drop('spatial_bounds', axis=1, inplace=True)
-            df.drop('temporal_coverage', axis=1, inplace=True)
+            df['temporal_coverage_start'], df['temporal_coverage_end'] = zip(*df['temporal_coverage'])
+            df.drop(columns=['spatial_bounds', 'temporal_coverage'], inplace=True)
     
             crs = "EPSG:4326"  # WGS84
             gdf = gpd.GeoDataFrame(df, geometry="spatial_coverage", crs=crs)
-            fname = f"{output_directory}/Landsat_footprints.geojson"
-            gdf.to_file(fname, driver='GeoJSON') 
+            write_footprints(gdf, output_directory, "Landsat")
 
         # download products
         if config.download_scenes:
             print(f"Downloading Landsat products for event: {event_id} to {output_directory} ...")
-            ee = EarthExplorer(config.username_landsat, config.password_landsat)
+            ee = _earth_explorer(config.username_landsat, config.password_landsat)
             
             #################################
             # Caution:
@@ -293,50 +589,47 @@ def get_landsat(event_id,
             #     if scene['display_id'] in download_ids:
             #         ee.download(scene['display_id'], output_dir=output_directory)
 
-            for scene in scenes:
-                ee.download(scene['display_id'], output_dir=output_directory)
-
-            ee.logout()
+            # downloads are I/O-bound, so run a bounded number of them in parallel
+            # over the same (logged in) EarthExplorer session
+            with ThreadPoolExecutor(max_workers=config.max_concurrent_downloads_landsat) as executor:
+                list(executor.map(lambda scene: ee.download(scene['display_id'], output_dir=output_directory),
+                                  scenes))
 
         # this part of the code was used at the begining of the project 
         # when we used individual json files. I don't think it'll be needed
         # anymore, but I kept it anyway
         if config.update_json:
         # Load the JSON file and append the scene information to it
-            with open(json_file_name, 'r') as file:
-                data = json.load(file)
-                data['features'][0]['landsat_senes'] = []
+            with open(json_file_name, 'rb') as file:
+                data = orjson.loads(file.read())
+                data['features'][0]['landsat_senes'] = [
+                    {
+                    'Scene_ID': scene['display_id'],
+                    'acquisition_date': scene['acquisition_date'].date(),
+                    'ingestion_date': scene['date_product_generated'].date(),
+                    'data_type': scene['data_type'],
+                    'footprint': scene['spatial_bounds'],
+                    'land_cloud_cover': scene['land_cloud_cover'],
+                    'scene_cloud_cover': scene['scene_cloud_cover']
+                    }
+                    for scene in scenes
+                ]
 
                 for scene in scenes:
-                        
-                        element = {
-                        'Scene_ID': scene['display_id'],
-                        'acquisition_date': scene['acquisition_date'].strftime('%Y-%m-%d'),
-                        'ingestion_date': scene['date_product_generated'].strftime('%Y-%m-%d'),
-                        'data_type': scene['data_type'],
-                        'footprint': scene['spatial_bounds'],
-                        'land_cloud_cover': scene['land_cloud_cover'],
-                        'scene_cloud_cover': scene['scene_cloud_cover']
-                        }
-
-                        data['features'][0]['landsat_senes'].append(element)
-
-                        # Write scene footprints to disk
-                        fname = f"{event_id}_{scene['landsat_product_id']}.geojson"
-                        with open(fname, "w") as f:
-                            json.dump(scene['spatial_coverage'].__geo_interface__, f)
+                    # Write scene footprints to disk
+                    fname = f"{event_id}_{scene['landsat_product_id']}.geojson"
+                    with open(fname, "wb") as f:
+                        f.write(orjson.dumps(scene['spatial_coverage'].__geo_interface__))
 
             # Write the modified JSON data back to the same file
             json_fname = os.path.join(output_directory, f"{event_id}.json")
-            with open(json_file_name, 'w') as file:
-                json.dump(data, file)
+            # orjson serializes the dates as "%Y-%m-%d" strings
+            with open(json_file_name, 'wb') as file:
+                file.write(orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY))
 
     else:
         print(f"No Landsat scenes found for the fire event {event_id}")
 
-    # Logout from the API
-    api.logout()
-
 
 def get_footprint_point(latitude, longitude,
                         delta_lat=0.1, delta_lon=0.05):
@@ -361,16 +654,8 @@ def get_footprint_point(latitude, longitude,
     Returns:
         str: The bounding box around the specified point, formatted as a WKT polygon.
     """
-    footprint = geojson_to_wkt({
-        "type": "Polygon",
-        "coordinates": [[
-            [longitude - delta_lon, latitude - delta_lat],
-            [longitude + delta_lon, latitude - delta_lat],
-            [longitude + delta_lon, latitude + delta_lat],
-            [longitude - delta_lon, latitude + delta_lat],
-            [longitude - delta_lon, latitude - delta_lat]
-        ]]
-    })
+    footprint = box(longitude - delta_lon, latitude - delta_lat,
+                    longitude + delta_lon, latitude + delta_lat).wkt
 
     return footprint
 
@@ -391,8 +676,7 @@ def get_footprint_poly(minlon, minlat, maxlon, maxlat):
     Returns:
         str: The bounding box defined by the specified coordinates, formatted as a WKT polygon.
     """
-    footprint = "polygon((" + str(maxlon) + " " + str(maxlat) + "," + str(maxlon) + " " + str(minlat) + ","  \
-    + str(minlon) + " " + str(minlat) + "," + str(minlon) + " " + str(maxlat) + "," + str(maxlon) + " " + str(maxlat) + "))"
+    footprint = box(minlon, minlat, maxlon, maxlat).wkt
 
     return footprint
 
@@ -432,38 +716,73 @@ def parse_jsons(filename):
         ### get coordinates from the dictionary, d.    
         coord_list = data['features'][0]['geometry']['coordinates'][0][0][:]  ## Put coordinates into a single list
     
-        ### Parse the list into x,y coordinates
-        x_arr = [];     y_arr = []   ## initialize x,y arrays
-        for n in range(len(coord_list)):  ### separate into 1 x n arrays for each x,y coordiante
-            x_arr.append(coord_list[n][0])
-            y_arr.append(coord_list[n][1])
-    
+        ### Find minimum/maximum extents of the x,y coordinates
+        coords = np.asarray(coord_list, dtype=np.float64)
+        minx, miny = coords.min(axis=0)[:2]
+        maxx, maxy = coords.max(axis=0)[:2]
 
-        ### Find minimum/maximum extents
-        minx = min(x_arr);     
-        maxx = max(x_arr);     
-        miny = min(y_arr);    
-        maxy = max(y_arr)
-
-    
-        ### convert EPSG 3395 to 4326
-        transformer = pyproj.Transformer.from_crs("epsg:3395", "epsg:4326")
-        minlat,minlon = transformer.transform(minx, miny)
-        maxlat,maxlon = transformer.transform(maxx, maxy)       
+        ### convert EPSG 3395 to 4326 (both corners at once)
+        (minlat, maxlat), (minlon, maxlon) = TRANSFORMER_3395_TO_4326.transform([minx, maxx], [miny, maxy])
 
     return fid, start_date, end_date, minlat, minlon, maxlat, maxlon
     
 
+def shp_to_gpkg(shp_filename, gpkg_filename):
+    """
+    Converts the shapefile of fire events to a GeoPackage.
+
+    GeoPackages are much faster to read than shapefiles.
+    The conversion only happens if the GeoPackage does not exist or is older than the shapefile.
+
+    Parameters:
+        shp_filename (str): The name of the shapefile containing fire event information.
+        gpkg_filename (str): The name of the GeoPackage to write.
+
+    Returns:
+        None
+    """
+    if os.path.exists(gpkg_filename) and os.path.getmtime(gpkg_filename) >= os.path.getmtime(shp_filename):
+        return
+
+    print(f"Converting {shp_filename} to {gpkg_filename} ...")
+    fires = pyogrio.read_dataframe(shp_filename, use_arrow=True)
+
+    # write to a temporary file first so an interrupted conversion never leaves a partial
+    # GeoPackage (which would look up to date) behind
+    directory, name = os.path.split(gpkg_filename)
+    tmp_filename = os.path.join(directory, f".{os.path.splitext(name)[0]}.{os.getpid()}.tmp.gpkg")
+    try:
+        pyogrio.write_dataframe(fires, tmp_filename, driver="GPKG")
+        os.replace(tmp_filename, gpkg_filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+@functools.lru_cache(maxsize=4)
+def _load_fires(filename):
+    """
+    Reads all the fire events of a GeoPackage, indexed by their ID.
+
+    The result is cached, so the file is only read once per process no matter how many
+    fire events are parsed from it (e.g. by main_batch).
+    """
+    fires = pyogrio.read_dataframe(filename, use_arrow=True).set_index('id')
+    # keep the first event of any duplicated ID so each lookup returns a single event
+    return fires[~fires.index.duplicated(keep='first')]
+
+
 def parse_shp(filename, fid):
     """
-    Parses a shapefile of fire events to extract specific fire event information.
-    The shapefile is the output of FiredPy package.
+    Parses a GeoPackage of fire events to extract specific fire event information.
+    The GeoPackage is converted from the shapefile output of FiredPy package (see shp_to_gpkg).
 
-    Given the filename of a shapefile and a fire event ID, this function
+    Given the filename of a GeoPackage and a fire event ID, this function
     extracts the start date, end date, and footprint of the specified fire event.
+    The file is only read the first time it is parsed (see _load_fires).
 
     Parameters:
-        filename (str): The name of the shapefile containing fire event information.
+        filename (str): The name of the GeoPackage containing fire event information.
         fid (int or str): The ID of the fire event to extract information from.
 
     Returns:
@@ -482,14 +801,15 @@ def parse_shp(filename, fid):
 
     """
     
-    fires = gpd.read_file(filename)
-    if not str(fid) in fires['id'].values:
+    fires = _load_fires(filename)
+    if not str(fid) in fires.index:
          print("invalid fire ID provided! Make sure the ID exists in the fire events shapefile")
          sys.exit()
-    fire_event = fires[fires['id'] == str(fid)]
-    start_date = datetime.strptime(fire_event['ig_date'].values[0], "%Y-%m-%d")
-    end_date = datetime.strptime(fire_event['last_date'].values[0], "%Y-%m-%d")
-    footprint = fire_event['geometry'].values[0]
+    fire_event = fires.loc[str(fid)]
+    # pyogrio reads date fields as datetime64 (fiona reads them as "%Y-%m-%d" strings)
+    start_date = pd.to_datetime(fire_event['ig_date']).to_pydatetime()
+    end_date = pd.to_datetime(fire_event['last_date']).to_pydatetime()
+    footprint = fire_event['geometry']
 
     return fid, start_date, end_date, footprint
 
@@ -507,10 +827,10 @@ def main(event_id, satellite):
         None
 
     Description:
-        The function reads the "selected_events.shp" shapefile containing fire event data and extracts the id, footprint, start, and end dates of the fire event.
+        The function reads the "selected_events.shp" shapefile (converted to "selected_events.gpkg") containing fire event data and extracts the id, footprint, start, and end dates of the fire event.
         Based on the selected satellite, the function searches for satellite images within a specified time window around the fire event and downloads them.
         The satellite images are filtered by the specified bounding box, start and end dates, and other satellite-specific parameters.
-        The footprints of the retrieved satellite images can be saved in GeoJSON format if configured.
+        The footprints of the retrieved satellite images can be saved in GeoParquet (or GeoJSON) format if configured.
         For Sentinel, the function retrieves images using the "get_sentinel" function.
         For Landsat, the function retrieves images using the "get_landsat" function.
 
@@ -525,8 +845,10 @@ def main(event_id, satellite):
     """
 
     file_dir = os.path.join(config.data_dir, "Fire_events")
-    file_name = os.path.join(file_dir, "selected_events.shp")
+    shp_file_name = os.path.join(file_dir, "selected_events.shp")
     # file_dir + "selected_events.shp"
+    file_name = os.path.join(file_dir, "selected_events.gpkg")
+    shp_to_gpkg(shp_file_name, file_name)
     
     fid, start_date, end_date, footprint = parse_shp(file_name, event_id)
     
@@ -540,7 +862,7 @@ def main(event_id, satellite):
     # whereas the Landsat API expects footprint as a tuple in the form of (xmin, ymin, xmax, ymax)
 
     # get the bounding box
-    polygon = shapely.geometry.box(*footprint.bounds, ccw=True)
+    minx, miny, maxx, maxy = footprint.bounds
 
     if satellite == "sentinel":
         time_delta = config.delta_days_sentinel
@@ -550,7 +872,7 @@ def main(event_id, satellite):
         print(f"and with the start date of: {adjusted_start_date} and end date of: {adjusted_end_date}")
         
         get_sentinel(fid,
-                polygon.wkt, 
+                get_footprint_poly(minx, miny, maxx, maxy), 
                 adjusted_start_date, 
                 adjusted_end_date, 
                 "json_file_name",
@@ -565,7 +887,7 @@ def main(event_id, satellite):
         print(f"and with the start date of: {adjusted_start_date} and end date of: {adjusted_end_date}")
 
         get_landsat(fid,
-                polygon.bounds, # this is equal to footprint.bounds 
+                (minx, miny, maxx, maxy), 
                 adjusted_start_date, 
                 adjusted_end_date, 
                 "json_file_name",
@@ -576,11 +898,64 @@ def main(event_id, satellite):
         sys.exit()
 
 
+def main_batch(event_ids, satellite):
+    """
+    Function to search for and download satellite images (Sentinel or Landsat) for several fire events in parallel.
+
+    Parameters:
+        event_ids (list of str): IDs of the fire events for which satellite images are to be searched.
+        satellite (str): Name of the satellite from which images are to be retrieved. Accepted values are "sentinel" and "landsat".
+
+    Returns:
+        None
+
+    Description:
+        Searching for and downloading images is I/O-bound, so the function runs the "main" function for
+        up to config.max_parallel_events fire events at the same time, each in its own thread.
+        All the threads share the same (logged in) API clients, which are created before the threads start.
+        A fire event that fails (e.g. because its ID does not exist) is skipped without stopping the other ones.
+    """
+
+    # convert and read the shapefile before starting the threads so they don't all try to do it at the same time
+    file_dir = os.path.join(config.data_dir, "Fire_events")
+    file_name = os.path.join(file_dir, "selected_events.gpkg")
+    shp_to_gpkg(os.path.join(file_dir, "selected_events.shp"), file_name)
+    _load_fires(file_name)
+
+    # likewise, create (and log in) the API clients before starting the threads: lru_cache does not
+    # stop several threads that miss the cache at the same time from each creating their own client
+    if satellite == "sentinel":
+        _sentinel_api(config.username_sentinel, config.password_sentinel)
+    elif satellite == "landsat":
+        _landsat_api(config.username_landsat, config.password_landsat)
+        if config.download_scenes:
+            _earth_explorer(config.username_landsat, config.password_landsat)
+
+    def run_event(event_id):
+        try:
+            main(event_id, satellite)
+        except SystemExit:
+            print(f"Skipping fire event {event_id}")
+        except Exception as e:
+            print(f"Skipping fire event {event_id} because of an error: {e!r}")
+
+    with ThreadPoolExecutor(max_workers=config.max_parallel_events) as executor:
+        list(executor.map(run_event, event_ids))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Search for and download satellite images for a given fire event.")
-    parser.add_argument("-id", "--event_id", type=str, help="ID of the fire event for which satellite images are to be searched. This comes from the id field of the fire events shapefile.")
+    event_group = parser.add_mutually_exclusive_group(required=True)
+    event_group.add_argument("-id", "--event_id", type=str, help="ID of the fire event for which satellite images are to be searched. This comes from the id field of the fire events shapefile.")
+    event_group.add_argument("-f", "--event_ids_file", type=str, help="Path to a text file with one fire event ID per line. The fire events are processed in parallel.")
     parser.add_argument("-s","--satellite", type=str, choices=["sentinel", "landsat"], help="Name of the satellite from which images are to be retrieved. Accepted values are 'sentinel' and 'landsat'.")
     args = parser.parse_args()
-    main(args.event_id, args.satellite)
+
+    if args.event_ids_file:
+        with open(args.event_ids_file) as f:
+            event_ids = [line.strip() for line in f if line.strip()]
+        main_batch(event_ids, args.satellite)
+    else:
+        main(args.event_id, args.satellite)
     
 